@@ -1,29 +1,85 @@
 import argparse
-import configparser
 import getpass
 import os
 import re
 import shutil
 import sys
 import warnings
-from datetime import datetime, date
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, time
+from time import sleep
 import posixpath
 from urllib.parse import urlparse
 
 import requests
 import requests.exceptions
-from bs4 import BeautifulSoup
+import requests_cache
+from requests.adapters import HTTPAdapter
+from bs4 import BeautifulSoup, SoupStrainer
+import soupsieve as sv
+import lxml.html
+from lxml import etree
 from rich.console import Console
 from tqdm import TqdmExperimentalWarning
 from tqdm.rich import tqdm
 
 _DEFAULT_CONFIG = '/usr/local/etc/kattisrc'
+_STUDENT_NAME_XPATH = etree.XPath("string((.//a)[1])")
+_STUDENT_CELL_XPATH = etree.XPath(
+    "*[contains(concat(' ', normalize-space(@class), ' '), ' standings-cell-score ')]/following-sibling::td[$n]")
+_CONFIG_LINE_RE = re.compile(r"^\[([^\]\n]+)\]|^(\w+)[ \t]*[:=][ \t]*(.*)$", re.M)
+_JUDGE_TABLE_STRAINER = SoupStrainer(id="judge_table")
+_SUBMISSION_ROWS = sv.compile("#judge_table > tbody > tr:not(.testcases-row)")
+_SUBMISSION_TIME = sv.compile('[data-type="time"]')
+_SUBMISSION_AUTHOR = sv.compile('[data-type="author"] a')
+_RED_WARNING = sv.compile(".plagiarism-warning-high")
+_YELLOW_WARNING = sv.compile(".plagiarism-warning")
+_STANDINGS_RE = re.compile(r"(https?://)?[^/]*\.kattis\.com/.+/assignments/.+/standings/?", re.ASCII)
+_PROBLEM_RE = re.compile(r"(https?://)?[^/]*\.kattis\.com/.+/assignments/.+/.+/?", re.ASCII)
+_ASSIGNMENT_RE = re.compile(r"(https?://)?[^/]*\.kattis\.com/.+/assignments/.+/?", re.ASCII)
 
 
 class ConfigError(Exception):
     pass
 
 
+class KattisConfig:
+    """Minimal reader for the [section] / key: value layout of .kattisrc files
+    Mirrors the subset of the ConfigParser interface used by this script
+    """
+
+    def __init__(self):
+        self._sections = {}
+
+    def read(self, filenames):
+        """Read and parse the given file(s), skipping any that cannot be opened.
+        Returns the list of files successfully read
+        """
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        read_ok = []
+        for filename in filenames:
+            try:
+                with open(filename, encoding='utf-8') as fp:
+                    text = fp.read()
+            except OSError:
+                continue
+            section = None
+            for name, key, value in _CONFIG_LINE_RE.findall(text):
+                if name:
+                    section = self._sections.setdefault(name, {})
+                elif section is not None:
+                    section[key.lower()] = value.strip()
+            read_ok.append(filename)
+        return read_ok
+
+    def has_option(self, section, option):
+        return option.lower() in self._sections.get(section, {})
+
+    def get(self, section, option):
+        return self._sections[section][option.lower()]
+
+
 def get_url(cfg, option="", default=""):
     if cfg.has_option('kattis', option):
         return cfg.get('kattis', option)
@@ -32,9 +88,9 @@ def get_url(cfg, option="", default=""):
 
 
 def get_config():
-    """Returns a ConfigParser object for the .kattisrc file(s)
+    """Returns a KattisConfig object for the .kattisrc file(s)
     """
-    cfg = configparser.ConfigParser()
+    cfg = KattisConfig()
     if os.path.exists(_DEFAULT_CONFIG):
         cfg.read(_DEFAULT_CONFIG)
 
@@ -76,14 +132,10 @@ def login_from_config(cfg):
     """
     username = cfg.get('user', 'username')
     password = token = None
-    try:
+    if cfg.has_option('user', 'password'):
         password = cfg.get('user', 'password')
-    except configparser.NoOptionError:
-        pass
-    try:
+    if cfg.has_option('user', 'token'):
         token = cfg.get('user', 'token')
-    except configparser.NoOptionError:
-        pass
     if password is None and token is None:
         raise ConfigError('''\
 Your .kattisrc file appears corrupted. It must provide a token (or a
@@ -94,10 +146,51 @@ Please download a new .kattisrc file''')
     return login(loginurl, username, password, token)
 
 
+def is_complete_page(response):
+    """Cache filter for the logged in session
+    Only submission pages that contain the judge table are cached, so login or error
+    pages served with a 200 status are never replayed from the cache
+    """
+    return b'judge_table' in response.content
+
+
+def strip_cookies(response, *args, **kwargs):
+    """Response hook removing the session cookies from a response before it is written to the cache
+    Only the response's own copies are cleared; the session keeps its cookie jar
+    """
+    response.request.headers.pop('Cookie', None)
+    response.request._cookies.clear()
+    response.headers.pop('Set-Cookie', None)
+    response.raw.headers.pop('Set-Cookie', None)
+    response.cookies.clear()
+    return response
+
+
+def get_submissions_page(session, submissions_url, params, page):
+    """Fetch a single page of the Kattis submissions list using a logged in session,
+    retrying once if rate limited
+    Returns the submission rows of the judge table on that page, which are empty past the last page
+    """
+    page_params = {**params, "page": page}
+    result = session.get(submissions_url, params=page_params)
+    if result.status_code == 429:
+        retry_after = result.headers.get("Retry-After", "")
+        sleep(int(retry_after) if retry_after.isdigit() else 1)
+        result = session.get(submissions_url, params=page_params)
+    result.raise_for_status()
+    soup = BeautifulSoup(result.content, 'lxml', parse_only=_JUDGE_TABLE_STRAINER)
+    if soup.find(id="judge_table") is None:
+        raise RuntimeError(f"No submissions table found on {result.url}; "
+                           "the login may have expired or Kattis returned an error page")
+    return _SUBMISSION_ROWS.select(soup)
+
+
 if __name__ == "__main__":
     FOLDER_ROOT = os.path.dirname(__file__)
     SUBMISSION_DIR = os.path.join(os.getcwd(), "submissions")
     DT_FORMAT = "%Y-%m-%d %H:%M"
+    PAGE_WINDOW = 8
+    CACHE_EXPIRY = 600
 
     today = date.today()
 
@@ -111,11 +204,11 @@ if __name__ == "__main__":
     standings_link = args.link
 
     console = Console()
-    if re.match("(https?://)?.*\.kattis\.com/.+/assignments/.+/standings/?", standings_link):
+    if _STANDINGS_RE.match(standings_link):
         pass
-    elif re.match("(https?://)?.*\.kattis\.com/.+/assignments/.+/.+/?", standings_link):
+    elif _PROBLEM_RE.match(standings_link):
         standings_link = posixpath.join(posixpath.dirname(standings_link), "standings")
-    elif re.match("(https?://)?.*\.kattis\.com/.+/assignments/.+/?", standings_link):
+    elif _ASSIGNMENT_RE.match(standings_link):
         standings_link = posixpath.join(standings_link, "standings")
     else:
         console.print("[red] Please input a link of a valid Kattis Standing Page")
@@ -158,59 +251,65 @@ if __name__ == "__main__":
             print('Status code:', login_reply.status_code)
         sys.exit(1)
 
-    login_cookies = login_reply.cookies
+    cache_name = "kattis_cache_" + re.sub(r"[^\w.-]", "_", user)
+    session = requests_cache.CachedSession(cache_name, use_cache_dir=True,
+                                           expire_after=CACHE_EXPIRY, filter_fn=is_complete_page)
+    session.cookies = login_reply.cookies
+    session.hooks["response"].append(strip_cookies)
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
 
     console.print(f"[green]Logged in as [white]{user}")
 
     with console.status("[green]Retrieving Assignments and Students") as status:
-        standings = requests.get(standings_link.strip(), cookies=login_cookies)
-        plain_standings = standings.content.decode('utf-8').replace('<br />', '\n')
-        soup = BeautifulSoup(plain_standings, 'html.parser')
+        with requests.get(standings_link.strip(), cookies=session.cookies, stream=True) as standings:
+            standings.raw.decode_content = True
+            root = lxml.html.parse(standings.raw, parser=lxml.html.HTMLParser(encoding='utf-8')).getroot()
+        start_text = " ".join(" ".join(root.find_class("contest-start")[0].itertext()).split()[1:-1])
         try:
-            start_time = datetime.strptime(
-                " ".join(soup.find(attrs={"class": "contest-start"}).getText().split()[1:-1]),
-                DT_FORMAT)
+            start_time = datetime.strptime(start_text, DT_FORMAT)
         except ValueError:
-            start_time = datetime.strptime(
-                " ".join(soup.find(attrs={"class": "contest-start"}).getText().split()[1:-1]),
-                "%H:%M")
+            start_time = datetime.strptime(start_text, "%H:%M")
             start_time = start_time.replace(year=today.year, month=today.month, day=today.day)
+        end_text = " ".join(" ".join(root.find_class("contest-end")[0].itertext()).split()[1:-1])
         try:
-            end_time = datetime.strptime(
-                " ".join(soup.find(attrs={"class": "contest-end"}).getText().split()[1:-1]),
-                DT_FORMAT)
+            end_time = datetime.strptime(end_text, DT_FORMAT)
         except ValueError:
-            end_time = datetime.strptime(
-                " ".join(soup.find(attrs={"class": "contest-end"}).getText().split()[1:-1]),
-                "%H:%M")
+            end_time = datetime.strptime(end_text, "%H:%M")
             end_time = end_time.replace(year=today.year, month=today.month, day=today.day)
-        table = soup.find(attrs={"class": "standings-table"})
+        table = root.find_class("standings-table")[0]
         if not args.q.isalpha():
             raise UserWarning("Input must be the alphabet representation of the question")
         question = ord(args.q.upper()[0]) - ord("A"[0])
-        assignment = table.find("thead").find_all("a")[question]
-        student_list = table.find_all_next("tr")[1:-1]
+        assignment = table.xpath("thead//a")[question]
+        student_list = table.xpath("tbody/tr")
 
         accepted = set()
         attempted = set()
         no_submission = set()
+        add_accepted = accepted.add
+        add_attempted = attempted.add
+        add_no_submission = no_submission.add
 
         for student in student_list:
-            username = student.find("a").getText().strip()
-            solve = student.find(attrs={"class": "standings-cell-score"}).find_all_next("td")[question]
-            if solve.get("class") is None:
-                no_submission.add(username)
-            elif "attempted" in solve.get("class"):
-                attempted.add(username)
-            elif "solved" in solve.get("class"):
-                accepted.add(username)
-            elif "first" in solve.get("class"):
-                accepted.add(username)
+            username = _STUDENT_NAME_XPATH(student).strip()
+            cells = _STUDENT_CELL_XPATH(student, n=question + 1)
+            if not username or not cells:
+                continue
+            solve = cells[0]
+            solve_class = set(solve.get("class", "").split())
+            if not solve_class:
+                add_no_submission(username)
+            elif "attempted" in solve_class:
+                add_attempted(username)
+            elif solve_class & {"solved", "first"}:
+                add_accepted(username)
             else:
                 raise RuntimeError
     console.print(f"[green]Retrieved Assignments and Students")
 
-    student_list = accepted.union(attempted).union(no_submission)
+    student_list = accepted.union(attempted, no_submission)
 
     page = 0
     submission_dict = {}
@@ -218,93 +317,105 @@ if __name__ == "__main__":
     yellow_plagiarism = set()
     late_submission = set()
     loop = True
+    parse_datetime = datetime.fromisoformat
+    parse_time = time.fromisoformat
+    add_red = red_plagiarism.add
+    add_yellow = yellow_plagiarism.add
+    add_late = late_submission.add
 
+    start_label = start_time.strftime(DT_FORMAT)
     problem = os.path.basename(os.path.normpath(urlparse(assignment.get("href")).path))
+    params = {"problem": problem, "language": "Java"}
+    if args.f:
+        params["status"] = "AC"
+    if args.p:
+        submissions_url = f"https://{kattis_domain}.kattis.com/submissions"
+    else:
+        submissions_url = get_url(cfg, 'submissionsurl', 'submissions')
+
     with console.status(f"[green]Retrieving Submissions for [white]{problem} [green]from "
-                        f"[white]{start_time.strftime(DT_FORMAT)}"):
+                        f"[white]{start_label}"), \
+            ThreadPoolExecutor(max_workers=PAGE_WINDOW) as executor:
         while loop:
-            params = {"problem": problem, "language": "Java", "page": page}
-            if args.f:
-                params["status"] = "AC"
-            if args.p:
-                result = requests.get(f"https://{kattis_domain}.kattis.com/submissions",
-                                      params=params, cookies=login_cookies)
-            else:
-                result = requests.get(get_url(cfg, 'submissionsurl', 'submissions'),
-                                      params=params, cookies=login_cookies)
-            page += 1
-            plain_result = result.content.decode('utf-8').replace('<br />', '\n')
-            soup = BeautifulSoup(plain_result, 'html.parser')
-            submissions = soup.find(id="judge_table").tbody.find_all_next("tr")
-            if len(submissions) == 0:
-                loop = False
-                break
-            for submission in submissions:
-                if submission.get("class") is not None and "testcases-row" in submission.get("class"):
-                    continue
-                id_ = submission.get("data-submission-id")
-                try:
-                    submit_time = datetime.strptime(submission.find(attrs={"data-type": "time"}).getText(),
-                                                    "%Y-%m-%d %H:%M:%S")
-                except ValueError:
-                    submit_time = datetime.strptime(submission.find(attrs={"data-type": "time"}).getText(), "%H:%M:%S")
-                    submit_time = submit_time.replace(year=today.year, month=today.month, day=today.day)
-                if submit_time < start_time:
+            # map() yields pages in order, so the start_time cut-off is unaffected by prefetching
+            try:
+                pages = list(executor.map(lambda p: get_submissions_page(session, submissions_url, params, p),
+                                          range(page, page + PAGE_WINDOW)))
+            except (requests.exceptions.RequestException, RuntimeError) as err:
+                print('Submission retrieval failed:', err)
+                sys.exit(1)
+            page += PAGE_WINDOW
+            for submissions in pages:
+                if not loop or len(submissions) == 0:
                     loop = False
                     break
-
-                try:
-                    author = submission.find(attrs={"data-type": "author"}).find("a").getText().strip()
-                except AttributeError:
-                    continue
-                if author in student_list:
-                    if submit_time > end_time and author in no_submission:
-                        late_submission.add(author)
-
-                    if author in accepted:
-                        submission_dict[author] = id_.strip()
-
-                    red_flag = bool(submission.find(attrs={"class": "plagiarism-warning-high"}))
-                    if red_flag:
-                        red_plagiarism.add(author)
-
-                    yellow_flag = bool(submission.find(attrs={"class": "plagiarism-warning"}))
-                    if yellow_flag:
-                        yellow_plagiarism.add(author)
+                for submission in submissions:
+                    id_ = submission.get("data-submission-id")
+                    time_text = _SUBMISSION_TIME.select_one(submission).getText().strip()
+                    if len(time_text) > len("HH:MM:SS"):
+                        submit_time = parse_datetime(time_text)
+                    else:
+                        submit_time = datetime.combine(today, parse_time(time_text))
+                    if submit_time < start_time:
+                        loop = False
+                        break
+
+                    try:
+                        author = _SUBMISSION_AUTHOR.select_one(submission).getText().strip()
+                    except AttributeError:
+                        continue
+                    if author in student_list:
+                        if submit_time > end_time and author in no_submission:
+                            add_late(author)
+
+                        if author in accepted:
+                            submission_dict[author] = id_.strip()
+
+                        red_flag = _RED_WARNING.select_one(submission) is not None
+                        if red_flag:
+                            add_red(author)
+
+                        yellow_flag = _YELLOW_WARNING.select_one(submission) is not None
+                        if yellow_flag:
+                            add_yellow(author)
     console.print(f"[green]All Submissions for [white]{problem} [green]from " +
-                  f"[white]{start_time.strftime(DT_FORMAT)} [green]Retrieved")
+                  f"[white]{start_label} [green]Retrieved")
 
-    submission_id_list = submission_dict.values()
+    submission_id_set = set(submission_dict.values())
 
     if not args.c:
         missing_submission = []
         try:
-            if len(os.listdir(SUBMISSION_DIR)) == 0:
+            with os.scandir(SUBMISSION_DIR) as it:
+                entries = list(it)
+            existing_submissions = {entry.name for entry in entries}
+            if len(entries) == 0:
                 console.print(f"[red]Warning: Submission Folder is Empty")
             else:
-                for submission in tqdm(os.listdir(SUBMISSION_DIR), desc="Removing redundant submissions"):
-                    if submission not in submission_id_list and os.path.isdir(os.path.join(SUBMISSION_DIR, submission)):
-                        shutil.rmtree(os.path.join(SUBMISSION_DIR, submission))
+                for entry in tqdm(entries, desc="Removing redundant submissions"):
+                    if entry.name not in submission_id_set and entry.is_dir():
+                        shutil.rmtree(entry.path)
                 for author, id_ in submission_dict.items():
-                    if id_ not in os.listdir(SUBMISSION_DIR):
+                    if id_ not in existing_submissions:
                         missing_submission.append(author)
                 if len(missing_submission) > 0:
                     console.print(f"[red]Submissions Missing: {missing_submission}")
         except FileNotFoundError:
             console.print(f"[red]Warning: Submission Folder Not Found")
 
+    report = [
+        ("red", "Red Plagiarism Notices:", sorted(red_plagiarism)),
+        ("yellow", "Yellow Plagiarism Notices:", sorted(yellow_plagiarism - red_plagiarism)),
+        ("cyan", "Early Submission :", sorted(accepted - submission_dict.keys())),
+        ("blue", "Late Submission:", sorted(late_submission)),
+        ("magenta", "Attempted Only:", sorted(attempted - late_submission)),
+        ("white", "No Submission:", sorted(no_submission - late_submission)),
+    ]
+
     console.rule(f"[green]Analysis Report")
-    console.print(f"[red]Red Plagiarism Notices: {sorted(red_plagiarism)}")
-    console.print(f"[yellow]Yellow Plagiarism Notices: {sorted(yellow_plagiarism.difference(red_plagiarism))}")
-    console.print(f"[cyan]Early Submission : {sorted(set(accepted).difference(submission_dict.keys()))}")
-    console.print(f"[blue]Late Submission: {sorted(late_submission)}")
-    console.print(f"[magenta]Attempted Only: {sorted(attempted.difference(late_submission))}")
-    console.print(f"[white]No Submission: {sorted(no_submission.difference(late_submission))}")
+    for colour, label, names in report:
+        console.print(f"[{colour}]{label} {names}")
 
     with open(os.path.join(os.getcwd(),f"{problem}_{datetime.now().strftime('%y%m%d%H%M%S')}.txt"), "w") as fp:
-        fp.write(f"Red Plagiarism Notices: {sorted(red_plagiarism)}\n")
-        fp.write(f"Yellow Plagiarism Notices: {sorted(yellow_plagiarism.difference(red_plagiarism))}\n")
-        fp.write(f"Early Submission : {sorted(set(accepted).difference(submission_dict.keys()))}\n")
-        fp.write(f"Late Submission: {sorted(late_submission)}\n")
-        fp.write(f"Attempted Only: {sorted(attempted.difference(late_submission))}\n")
-        fp.write(f"No Submission: {sorted(no_submission.difference(late_submission))}\n")
\ No newline at end of file
+        for _, label, names in report:
+            fp.write(f"{label} {names}\n")
@@ -2,14 +2,17 @@ import requests
 from urllib3.util import parse_url
 import argparse
 import os
+import shutil
 
 parser = argparse.ArgumentParser()
-parser.add_argument("link", type=str, help="Link to GitHub Raw")
+parser.add_argument("link", type=str, nargs="+", help="Link(s) to GitHub Raw")
 args = parser.parse_args()
-result = requests.get(args.link)
-file = result.text
-parsed = parse_url(args.link).path.split("/")
-if not os.path.isdir(os.path.join(os.getcwd(),"submissions", parsed[1])):
-    os.mkdir(os.path.join(os.getcwd(),"submissions", parsed[1]))
-with open(os.path.join(os.getcwd(),"submissions", parsed[1], parsed[-1]), 'w') as f:
-    f.write(file)
+with requests.Session() as session:
+    for link in args.link:
+        result = session.get(link, stream=True)
+        result.raise_for_status()
+        result.raw.decode_content = True
+        parsed = parse_url(link).path.split("/")
+        os.makedirs(os.path.join(os.getcwd(), "submissions", parsed[1]), exist_ok=True)
+        with open(os.path.join(os.getcwd(), "submissions", parsed[1], parsed[-1]), 'wb') as f:
+            shutil.copyfileobj(result.raw, f)